@@ -1,10 +1,15 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, request, jsonify, render_template_string, Response
 from flask_cors import CORS
 import sqlite3
 import uuid
 import datetime
 import logging
 import os
+import json
+import queue
+import threading
+import bisect
+import math
 
 try:
     import torch
@@ -22,6 +27,8 @@ DUPLICATE_THRESHOLD = 92.0
 HIGH_SIMILARITY_THRESHOLD = 78.0
 MEDIUM_SIMILARITY_THRESHOLD = 65.0
 DB_PATH = "projectaudit.db"
+EVENT_POLL_SECONDS = 5
+EVENT_RETENTION_HOURS = 24
 
 @app.route('/api/debug_db', methods=['GET'])
 def debug_db():
@@ -84,6 +91,32 @@ def init_db():
             UNIQUE(project_id_1, project_id_2)
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS project_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            faculty_email TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_project_events_faculty ON project_events (faculty_email, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_project_events_created_at ON project_events (created_at)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS faculty_thresholds (
+            faculty_email TEXT PRIMARY KEY,
+            duplicate_threshold REAL NOT NULL,
+            high_similarity_threshold REAL NOT NULL,
+            medium_similarity_threshold REAL NOT NULL,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS faculty_score_versions (
+            faculty_email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_projects_faculty ON projects (assignedFacultyEmail)")
     conn.commit()
     cursor.close()
     conn.close()
@@ -142,6 +175,131 @@ def execute_query(query, params=None):
             conn.close()
     return False
 
+# --- Faculty Event Stream (pub/sub) ---
+# Every change is appended to the project_events table, which is the source of
+# truth for all workers. Subscribers in this process are woken through their
+# queue; subscribers in other worker processes pick the row up on their next poll.
+_event_subscribers = {}
+_event_subscribers_lock = threading.Lock()
+
+def subscribe_faculty_events(faculty_email):
+    q = queue.Queue()
+    with _event_subscribers_lock:
+        _event_subscribers.setdefault(faculty_email, []).append(q)
+    return q
+
+def unsubscribe_faculty_events(faculty_email, q):
+    with _event_subscribers_lock:
+        subscribers = _event_subscribers.get(faculty_email, [])
+        if q in subscribers:
+            subscribers.remove(q)
+        if not subscribers:
+            _event_subscribers.pop(faculty_email, None)
+
+def publish_faculty_event(faculty_email, payload):
+    faculty_email = (faculty_email or '').strip().lower()
+    if not faculty_email:
+        return
+    now = datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(hours=EVENT_RETENTION_HOURS)).isoformat()
+    execute_query("INSERT INTO project_events (faculty_email, payload, created_at) VALUES (?, ?, ?)",
+                  (faculty_email, json.dumps(payload), now.isoformat()))
+    execute_query("DELETE FROM project_events WHERE created_at < ?", (cutoff,))
+    with _event_subscribers_lock:
+        subscribers = list(_event_subscribers.get(faculty_email, []))
+    for q in subscribers:
+        q.put_nowait(True)
+
+def fetch_faculty_events_since(faculty_email, last_event_id):
+    query = "SELECT id, payload FROM project_events WHERE faculty_email = ? AND id > ? ORDER BY id"
+    return fetch_all(query, (faculty_email, last_event_id))
+
+def get_latest_event_id():
+    # sqlite_sequence keeps the last issued id even after pruning empties the table.
+    row = fetch_one("SELECT seq FROM sqlite_sequence WHERE name = 'project_events'")
+    return row['seq'] if row else 0
+
+def get_oldest_event_id():
+    row = fetch_one("SELECT MIN(id) AS first_id FROM project_events")
+    if row and row['first_id'] is not None:
+        return row['first_id']
+    return get_latest_event_id() + 1
+
+# --- Per-Faculty Similarity Thresholds ---
+def get_faculty_thresholds(faculty_email):
+    query = "SELECT duplicate_threshold, high_similarity_threshold, medium_similarity_threshold FROM faculty_thresholds WHERE faculty_email = ?"
+    row = fetch_one(query, ((faculty_email or '').strip().lower(),))
+    if row:
+        return row
+    return {
+        'duplicate_threshold': DUPLICATE_THRESHOLD,
+        'high_similarity_threshold': HIGH_SIMILARITY_THRESHOLD,
+        'medium_similarity_threshold': MEDIUM_SIMILARITY_THRESHOLD
+    }
+
+def thresholds_are_valid(thresholds):
+    values = [thresholds['duplicate_threshold'], thresholds['high_similarity_threshold'],
+              thresholds['medium_similarity_threshold']]
+    return all(math.isfinite(v) for v in values) and 100 >= values[0] >= values[1] >= values[2] >= 0
+
+def classify_similarity(similarity_percentage, thresholds):
+    if similarity_percentage >= thresholds['duplicate_threshold']:
+        return 'DUPLICATE'
+    elif similarity_percentage >= thresholds['high_similarity_threshold']:
+        return 'HIGH_SIMILARITY'
+    elif similarity_percentage >= thresholds['medium_similarity_threshold']:
+        return 'MEDIUM_SIMILARITY'
+    return 'UNIQUE'
+
+def reflag_faculty_projects(faculty_email, thresholds):
+    # Rewrites every flag for the faculty from the stored scores in one statement;
+    # the similarity model is not involved.
+    query = """
+    UPDATE projects SET similarity_flag = CASE
+        WHEN similarity_percentage >= ? THEN 'DUPLICATE'
+        WHEN similarity_percentage >= ? THEN 'HIGH_SIMILARITY'
+        WHEN similarity_percentage >= ? THEN 'MEDIUM_SIMILARITY'
+        ELSE 'UNIQUE'
+    END
+    WHERE assignedFacultyEmail = ?
+    """
+    return execute_query(query, (
+        thresholds['duplicate_threshold'], thresholds['high_similarity_threshold'],
+        thresholds['medium_similarity_threshold'], faculty_email
+    ))
+
+# Sorted similarity scores per faculty. Submit, resubmit and delete bump the
+# faculty's row in faculty_score_versions, so a single primary-key lookup tells
+# every worker whether its cached list is still current.
+_faculty_score_cache = {}
+_faculty_score_cache_lock = threading.Lock()
+
+def bump_faculty_score_version(faculty_email):
+    query = """
+    INSERT INTO faculty_score_versions (faculty_email, version) VALUES (?, 1)
+    ON CONFLICT(faculty_email) DO UPDATE SET version = version + 1
+    """
+    return execute_query(query, ((faculty_email or '').strip().lower(),))
+
+def get_faculty_scores(faculty_email):
+    row = fetch_one("SELECT version FROM faculty_score_versions WHERE faculty_email = ?", (faculty_email,))
+    version = row['version'] if row else 0
+    with _faculty_score_cache_lock:
+        cached = _faculty_score_cache.get(faculty_email)
+    if cached and cached[0] == version:
+        return cached[1]
+    query = """
+    SELECT COALESCE(similarity_percentage, 0) AS score FROM projects
+    WHERE assignedFacultyEmail = ? ORDER BY COALESCE(similarity_percentage, 0)
+    """
+    scores = [p['score'] for p in fetch_all(query, (faculty_email,))]
+    with _faculty_score_cache_lock:
+        _faculty_score_cache[faculty_email] = (version, scores)
+    return scores
+
+def count_scores_at_or_above(scores, threshold):
+    return len(scores) - bisect.bisect_left(scores, threshold)
+
 def get_user_by_email_db(email):
     query = "SELECT id, name, email, password, role FROM users WHERE email = ?"
     return fetch_one(query, (email.strip().lower(),))
@@ -296,14 +454,7 @@ def submit_project():
     similarity_percentage, most_similar_proj = calculate_semantic_similarity(new_project, existing_projects)
 
     # Determine similarity flag
-    if similarity_percentage >= DUPLICATE_THRESHOLD:
-        similarity_flag = 'DUPLICATE'
-    elif similarity_percentage >= HIGH_SIMILARITY_THRESHOLD:
-        similarity_flag = 'HIGH_SIMILARITY'
-    elif similarity_percentage >= MEDIUM_SIMILARITY_THRESHOLD:
-        similarity_flag = 'MEDIUM_SIMILARITY'
-    else:
-        similarity_flag = 'UNIQUE'
+    similarity_flag = classify_similarity(similarity_percentage, get_faculty_thresholds(assigned_faculty_email))
 
     project_id = str(uuid.uuid4())
     submitted_on = datetime.datetime.now().isoformat()
@@ -320,6 +471,11 @@ def submit_project():
 
     if success:
         update_project_similarity(project_id, title, description, assigned_faculty_email)
+        bump_faculty_score_version(assigned_faculty_email)
+        publish_faculty_event(assigned_faculty_email, {
+            'type': 'project_submitted',
+            'project': get_project_by_id_db(project_id)
+        })
         response = {
             'success': True,
             'message': 'Project submitted successfully!',
@@ -371,10 +527,15 @@ def get_faculty_projects():
             return jsonify({'success': False, 'message': 'Faculty email is required.'}), 400
         clean_email = faculty_email.strip().lower()
         logging.info(f"[DEBUG] Faculty project query for email: '{clean_email}'")
+        # Taken before the list so a stream opened from this cursor replays
+        # anything committed while the list was being read.
+        last_event_id = get_latest_event_id()
         query = "SELECT * FROM projects WHERE LOWER(assignedFacultyEmail) = LOWER(?) ORDER BY similarity_percentage DESC, submittedOn DESC"
         faculty_projects = fetch_all(query, (clean_email,))
         logging.info(f"[DEBUG] Found {len(faculty_projects)} projects for faculty: '{clean_email}'")
-        return jsonify(faculty_projects)
+        response = jsonify(faculty_projects)
+        response.headers['X-Last-Event-ID'] = str(last_event_id)
+        return response
     except Exception as e:
         logging.error(f"Error fetching faculty projects: {e}")
         return jsonify([])
@@ -401,8 +562,18 @@ def update_project_status(project_id):
         WHERE id = ?
         """
         try:
-            result = execute_query(update_query, (new_status, faculty_comment, datetime.datetime.now().isoformat(), project_id))
+            updated_at = datetime.datetime.now().isoformat()
+            result = execute_query(update_query, (new_status, faculty_comment, updated_at, project_id))
             if result:
+                publish_faculty_event(project['assignedFacultyEmail'], {
+                    'type': 'project_updated',
+                    'project': {
+                        'id': project_id,
+                        'status': new_status,
+                        'faculty_comment': faculty_comment,
+                        'updated_at': updated_at
+                    }
+                })
                 return jsonify({'success': True, 'message': 'Project status updated.'}), 200
             else:
                 logging.error(f"Failed to update project status for {project_id} (query returned False)")
@@ -429,14 +600,7 @@ def resubmit_project(project_id):
         existing_projects = fetch_all(existing_projects_query, (project_id, project['submittedBy']))
         new_project = {'title': title, 'description': description}
         similarity_percentage, _ = calculate_semantic_similarity(new_project, existing_projects)
-        if similarity_percentage >= DUPLICATE_THRESHOLD:
-            similarity_flag = 'DUPLICATE'
-        elif similarity_percentage >= HIGH_SIMILARITY_THRESHOLD:
-            similarity_flag = 'HIGH_SIMILARITY'
-        elif similarity_percentage >= MEDIUM_SIMILARITY_THRESHOLD:
-            similarity_flag = 'MEDIUM_SIMILARITY'
-        else:
-            similarity_flag = 'UNIQUE'
+        similarity_flag = classify_similarity(similarity_percentage, get_faculty_thresholds(project['assignedFacultyEmail']))
         update_query = """
         UPDATE projects SET title = ?, description = ?, status = 'pending',
         faculty_comment = NULL, similarity_percentage = ?, similarity_flag = ?, updated_at = ?, submittedOn = ?
@@ -447,6 +611,21 @@ def resubmit_project(project_id):
             title, description, similarity_percentage, similarity_flag,
             now_iso, now_iso, project_id
         )):
+            bump_faculty_score_version(project['assignedFacultyEmail'])
+            publish_faculty_event(project['assignedFacultyEmail'], {
+                'type': 'project_updated',
+                'project': {
+                    'id': project_id,
+                    'title': title,
+                    'description': description,
+                    'status': 'pending',
+                    'faculty_comment': None,
+                    'similarity_percentage': similarity_percentage,
+                    'similarity_flag': similarity_flag,
+                    'updated_at': now_iso,
+                    'submittedOn': now_iso
+                }
+            })
             return jsonify({
                 'success': True, 
                 'message': 'Project updated and resubmitted successfully.',
@@ -467,6 +646,11 @@ def delete_project(project_id):
             return jsonify({'success': False, 'message': 'Project not found.'}), 404
         query = "DELETE FROM projects WHERE id = ?"
         if execute_query(query, (project_id,)):
+            bump_faculty_score_version(project['assignedFacultyEmail'])
+            publish_faculty_event(project['assignedFacultyEmail'], {
+                'type': 'project_deleted',
+                'project': {'id': project_id}
+            })
             return jsonify({'success': True, 'message': 'Project deleted successfully.'}), 200
         else:
             return jsonify({'success': False, 'message': 'Failed to delete project.'}), 500
@@ -474,6 +658,53 @@ def delete_project(project_id):
         logging.error(f"Delete error: {e}")
         return jsonify({'success': False, 'message': 'Delete failed - server error.'}), 500
 
+@app.route('/api/events/faculty', methods=['GET'])
+def faculty_event_stream():
+    faculty_email = request.args.get('email')
+    if not faculty_email:
+        return jsonify({'success': False, 'message': 'Faculty email is required.'}), 400
+    clean_email = faculty_email.strip().lower()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id)
+    except (TypeError, ValueError):
+        # No cursor from the client: only changes from now on are relevant.
+        last_event_id = get_latest_event_id()
+    # Events after the cursor were pruned; the client has to reload the full list.
+    needs_resync = last_event_id < get_oldest_event_id() - 1
+
+    def stream(last_event_id):
+        q = subscribe_faculty_events(clean_email)
+        try:
+            # Send the cursor up front so a reconnect before the first event
+            # still resumes from here instead of starting fresh.
+            yield f"retry: {EVENT_POLL_SECONDS * 1000}\nid: {last_event_id}\n\n"
+            if needs_resync:
+                last_event_id = get_latest_event_id()
+                yield f"id: {last_event_id}\ndata: {json.dumps({'type': 'resync'})}\n\n"
+            while True:
+                try:
+                    q.get(timeout=EVENT_POLL_SECONDS)
+                    # Coalesce wake-ups that arrived while we were busy.
+                    while not q.empty():
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                events = fetch_faculty_events_since(clean_email, last_event_id)
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in events:
+                    last_event_id = event['id']
+                    yield f"id: {event['id']}\ndata: {event['payload']}\n\n"
+        finally:
+            unsubscribe_faculty_events(clean_email, q)
+
+    return Response(stream(last_event_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/faculty_list', methods=['GET'])
 def get_faculty_list():
     try:
@@ -494,7 +725,9 @@ def similarity_analysis():
         # Get all projects for this faculty
         query = "SELECT id, title, description, submittedByName, submittedBy, similarity_percentage, similarity_flag, status FROM projects WHERE assignedFacultyEmail = ?"
         projects = fetch_all(query, (faculty_email.strip().lower(),))
-        # Find duplicate and high similarity pairs
+        # Find duplicate and high similarity pairs from the stored flags, so the
+        # analysis agrees with the stat cards until the faculty re-flags.
+        flag_rank = {'DUPLICATE': 3, 'HIGH_SIMILARITY': 2, 'MEDIUM_SIMILARITY': 1}
         duplicate_pairs = []
         high_similarity_pairs = []
         for i, p1 in enumerate(projects):
@@ -505,13 +738,14 @@ def similarity_analysis():
                         sim = max(p1.get('similarity_percentage', 0), p2.get('similarity_percentage', 0))
                     except Exception:
                         pass
-                    if sim >= DUPLICATE_THRESHOLD:
+                    rank = max(flag_rank.get(p1.get('similarity_flag'), 0), flag_rank.get(p2.get('similarity_flag'), 0))
+                    if rank == 3:
                         duplicate_pairs.append({
                             'project1': {'title': p1['title'], 'student': p1['submittedByName'], 'status': p1['status']},
                             'project2': {'title': p2['title'], 'student': p2['submittedByName'], 'status': p2['status']},
                             'similarity_score': sim
                         })
-                    elif sim >= HIGH_SIMILARITY_THRESHOLD:
+                    elif rank == 2:
                         high_similarity_pairs.append({
                             'project1': {'title': p1['title'], 'student': p1['submittedByName'], 'status': p1['status']},
                             'project2': {'title': p2['title'], 'student': p2['submittedByName'], 'status': p2['status']},
@@ -535,13 +769,13 @@ def faculty_stats():
         faculty_email = request.args.get('email')
         if not faculty_email:
             return jsonify({'success': False, 'message': 'Faculty email is required.'}), 400
-        query = "SELECT status, similarity_percentage FROM projects WHERE assignedFacultyEmail = ?"
+        query = "SELECT status, similarity_percentage, similarity_flag FROM projects WHERE assignedFacultyEmail = ?"
         projects = fetch_all(query, (faculty_email.strip().lower(),))
         total = len(projects)
         pending = sum(1 for p in projects if p['status'] == 'pending')
         approved = sum(1 for p in projects if p['status'] == 'approved')
         rejected = sum(1 for p in projects if p['status'] == 'rejected')
-        duplicates = sum(1 for p in projects if p.get('similarity_percentage', 0) >= DUPLICATE_THRESHOLD)
+        duplicates = sum(1 for p in projects if p.get('similarity_flag') == 'DUPLICATE')
         avg_similarity = round(sum(p.get('similarity_percentage', 0) for p in projects) / total, 2) if total else 0
         return jsonify({
             'total': total,
@@ -555,11 +789,97 @@ def faculty_stats():
         logging.error(f"Faculty stats error: {e}")
         return jsonify({'success': False, 'message': 'Faculty stats failed.'}), 500
 
+# --- Faculty Threshold Endpoints ---
+@app.route('/api/faculty_thresholds', methods=['GET'])
+def faculty_thresholds():
+    faculty_email = request.args.get('email')
+    if not faculty_email:
+        return jsonify({'success': False, 'message': 'Faculty email is required.'}), 400
+    return jsonify(get_faculty_thresholds(faculty_email))
+
+@app.route('/api/faculty_thresholds', methods=['PUT'])
+def update_faculty_thresholds():
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'message': 'No data received'}), 400
+        faculty_email = (data.get('email') or '').strip().lower()
+        faculty = get_user_by_email_db(faculty_email) if faculty_email else None
+        if not faculty or faculty['role'] != 'faculty':
+            return jsonify({'success': False, 'message': 'Faculty not found or invalid.'}), 400
+        thresholds = get_faculty_thresholds(faculty_email)
+        try:
+            for key in thresholds:
+                if data.get(key) is not None:
+                    thresholds[key] = float(data[key])
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Thresholds must be numbers.'}), 400
+        if not thresholds_are_valid(thresholds):
+            return jsonify({'success': False, 'message': 'Thresholds must satisfy 100 ≥ duplicate ≥ high ≥ medium ≥ 0.'}), 400
+        query = """
+        REPLACE INTO faculty_thresholds (faculty_email, duplicate_threshold, high_similarity_threshold,
+                                         medium_similarity_threshold, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        """
+        if not execute_query(query, (
+            faculty_email, thresholds['duplicate_threshold'], thresholds['high_similarity_threshold'],
+            thresholds['medium_similarity_threshold'], datetime.datetime.now().isoformat()
+        )):
+            return jsonify({'success': False, 'message': 'Failed to save thresholds.'}), 500
+        response = {'success': True, 'message': 'Thresholds updated.', 'thresholds': thresholds}
+        if data.get('reflag'):
+            if not reflag_faculty_projects(faculty_email, thresholds):
+                return jsonify({'success': False, 'message': 'Thresholds saved but re-flagging failed.'}), 500
+            publish_faculty_event(faculty_email, {'type': 'projects_reflagged', 'thresholds': thresholds})
+            response['message'] = 'Thresholds updated and projects re-flagged.'
+        return jsonify(response), 200
+    except Exception as e:
+        logging.error(f"Threshold update error: {e}")
+        return jsonify({'success': False, 'message': 'Threshold update failed - server error.'}), 500
+
+@app.route('/api/faculty_thresholds/whatif', methods=['GET'])
+def faculty_thresholds_whatif():
+    try:
+        faculty_email = request.args.get('email')
+        if not faculty_email:
+            return jsonify({'success': False, 'message': 'Faculty email is required.'}), 400
+        clean_email = faculty_email.strip().lower()
+        thresholds = get_faculty_thresholds(clean_email)
+        try:
+            for key in thresholds:
+                if request.args.get(key) is not None:
+                    thresholds[key] = float(request.args[key])
+            extra = [float(t) for t in request.args.get('thresholds', '').split(',') if t.strip()]
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Thresholds must be numbers.'}), 400
+        if not thresholds_are_valid(thresholds):
+            return jsonify({'success': False, 'message': 'Thresholds must satisfy 100 ≥ duplicate ≥ high ≥ medium ≥ 0.'}), 400
+        if not all(math.isfinite(t) for t in extra):
+            return jsonify({'success': False, 'message': 'Thresholds must be finite numbers.'}), 400
+        scores = get_faculty_scores(clean_email)
+        duplicates = count_scores_at_or_above(scores, thresholds['duplicate_threshold'])
+        high = count_scores_at_or_above(scores, thresholds['high_similarity_threshold'])
+        medium = count_scores_at_or_above(scores, thresholds['medium_similarity_threshold'])
+        return jsonify({
+            'total': len(scores),
+            'thresholds': thresholds,
+            'flags': {
+                'DUPLICATE': duplicates,
+                'HIGH_SIMILARITY': high - duplicates,
+                'MEDIUM_SIMILARITY': medium - high,
+                'UNIQUE': len(scores) - medium
+            },
+            'counts': [{'threshold': t, 'count': count_scores_at_or_above(scores, t)} for t in extra]
+        })
+    except Exception as e:
+        logging.error(f"Threshold what-if error: {e}")
+        return jsonify({'success': False, 'message': 'Threshold what-if failed.'}), 500
+
 if __name__ == '__main__':
     print("🚀 Starting ProjectAudit Server...")
     print(f"📊 Database: {DB_PATH}")
     print(f"🤖 AI Similarity: {'Enabled' if SIMILARITY_ENABLED else 'Disabled (using basic similarity)'}")
-    print(f"📈 Similarity Thresholds: Duplicate≥{DUPLICATE_THRESHOLD}%, High≥{HIGH_SIMILARITY_THRESHOLD}%")
+    print(f"📈 Default Similarity Thresholds: Duplicate≥{DUPLICATE_THRESHOLD}%, High≥{HIGH_SIMILARITY_THRESHOLD}%")
     print("✅ Server ready!")
     init_db()
     app.run(debug=True, port=5000, host='0.0.0.0')